@@ -2,35 +2,21 @@
 import logging
 import os
 import re
-from dotenv import load_dotenv
 from telegram import ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters, CallbackQueryHandler, ChatMemberHandler
 from pymongo.errors import OperationFailure, DuplicateKeyError
-from db import connect_to_mongodb, get_file_info_by_hash, get_users_collection, get_log_collection, close_mongodb_connection, get_file_info_by_user, add_user_downloaded_file, update_file_thumbnail
-from premium import download_file_from_premium_to, create_video_thumbnail_sheet_async
+from db import connect_to_mongodb, get_file_info_by_hash, get_users_collection, get_log_collection, get_file_info_by_user, add_user_downloaded_file, update_file_thumbnail
+from premium import download_file_from_premium_to, create_video_thumbnail_sheet_async, guess_mime_type_from_header, close_session
 import mimetypes
 import math
-from pathlib import Path
 import asyncio
-from audio_processing import process_audio_message, load_words_from_file, gap_fillers, useless_words, conjunctions, generate_hashtags
-from telegram.request import HTTPXRequest
+from audio_processing import process_audio_message, generate_hashtags
+from settings import settings
 
 # Constants
 FILE_SIZE_LIMIT = 50 * 1024 * 1024  # 50 MB
 PAGE_SIZE = 5  # Number of files per page
 
-# Load environment variables
-load_dotenv()
-
-# Telegram Bot Token
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-API_KEY = os.getenv("API_KEY")
-USER_ID = os.getenv("USER_ID")
-DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR")
-FILE_HOST_BASE_URL = os.getenv("FILE_HOST_BASE_URL")
-IMAGES_DIR = os.getenv("IMAGES_DIR")
-ADMIN_USER_ID = os.getenv("ADMIN_USER_ID")
-
 # Configure logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -54,7 +40,6 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.message.reply_text("No files found.")
             return
 
-        total_pages = math.ceil(len(files_info) / PAGE_SIZE)
         await send_premium_page(update, context, files_info, 0)  # Send the first page initially
 
     except OperationFailure as e:
@@ -66,28 +51,31 @@ async def premium_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def send_premium_page(update: Update, context: ContextTypes.DEFAULT_TYPE, files_info, page):
     """Sends a single page of the /premium command output."""
-    user_id = update.effective_user.id
     start_index = page * PAGE_SIZE
     end_index = start_index + PAGE_SIZE
     page_files = files_info[start_index:end_index]
     total_pages = math.ceil(len(files_info) / PAGE_SIZE)
 
-    for file_info in page_files:
+    # Stat the whole page concurrently in worker threads instead of one by one on the event loop
+    file_sizes = await asyncio.gather(
+        *(asyncio.to_thread(os.path.getsize, file_info["file_path"]) for file_info in page_files),
+        return_exceptions=True
+    )
+
+    for file_info, file_size in zip(page_files, file_sizes):
         file_hash = file_info["file_hash"]
         original_filename = file_info["original_filename"]
         file_path = file_info["file_path"]
         thumbnail_path = file_info.get("thumbnail_path")
 
-        download_url = f"{FILE_HOST_BASE_URL}/download/{file_hash}"
+        download_url = f"{settings.file_host_base_url}/download/{file_hash}"
 
-        try:
-            file_size = os.path.getsize(file_path)
-        except FileNotFoundError:
+        if isinstance(file_size, FileNotFoundError):
             logger.error(f"File not found: {file_path}")
             await update.message.reply_text(f"Error: File '{original_filename}' not found.")
             continue
-        except Exception as e:
-            logger.error(f"Error getting file size for {file_path}: {e}")
+        elif isinstance(file_size, Exception):
+            logger.error(f"Error getting file size for {file_path}: {file_size}")
             await update.message.reply_text(f"Error: Could not retrieve file size for '{original_filename}'.")
             continue
 
@@ -411,7 +399,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
         # Download the file (without waiting for thumbnail generation)
         result = await download_file_from_premium_to(
-            message_text, user_id, API_KEY, USER_ID, DOWNLOAD_DIR, update, context, processing_message
+            message_text, user_id, settings.api_key, settings.premium_user_id, settings.download_dir, update, context, processing_message
         )
 
         # Log the outcome
@@ -421,7 +409,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             file_url = result["file_url"]
 
             # Add file to user's downloaded files in the database
-            add_user_downloaded_file(user_id, file_hash)
+            add_user_downloaded_file(user_id, file_hash, result["file_path"], result["original_filename"])
 
             if file_url:
                 log_event = "download_success_link"
@@ -445,7 +433,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 logger.error(f"MongoDB operation failed: {e}")
 
             # Edit the processing message to show the download link
-            await processing_message.edit_text(f"Your file has been downloaded: {file_url}")
+            if file_url:
+                await processing_message.edit_text(f"Your file has been downloaded: {file_url}")
+            else:
+                await processing_message.edit_text("Your file has been downloaded and sent above.")
 
             # Schedule thumbnail generation as a background task
             asyncio.create_task(generate_thumbnail_and_notify(file_hash, user_id, update))
@@ -480,9 +471,15 @@ async def generate_thumbnail_and_notify(file_hash, user_id, update: Update):
             return
 
         file_path = file_info["file_path"]
-        images_dir = os.getenv("IMAGES_DIR")
-        thumbnail_dir = Path(images_dir) / str(user_id)
-        thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        thumbnail_dir = settings.images_dir / str(user_id)
+        # Sniff the file type and prepare the thumbnail directory off the event loop, together
+        mime_type, _ = await asyncio.gather(
+            asyncio.to_thread(guess_mime_type_from_header, str(file_path)),
+            asyncio.to_thread(thumbnail_dir.mkdir, parents=True, exist_ok=True),
+        )
+        if not mime_type or not mime_type.startswith("video/"):
+            logger.info(f"Skipping thumbnail for {file_hash}: not a video ({mime_type})")
+            return
         thumbnail_path = thumbnail_dir / f"{file_hash}.jpg"
 
         await create_video_thumbnail_sheet_async(str(file_path), str(thumbnail_path))
@@ -523,7 +520,7 @@ async def group_post_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     chat_id = update.effective_chat.id
-    admin_user_id = int(ADMIN_USER_ID) # Convert to integer
+    admin_user_id = int(settings.admin_user_id) # Convert to integer
 
     try:
         # Get the last 50 messages (adjust as needed)
@@ -566,7 +563,7 @@ async def run_bot():
     logger.info("Setting up the bot...")
     connect_to_mongodb()
 
-    bot_app = Application.builder().token(BOT_TOKEN).connect_timeout(20).read_timeout(20).get_updates_request_timeout(20).pool_timeout(20).build()
+    bot_app = Application.builder().token(settings.telegram_bot_token).connect_timeout(20).read_timeout(20).get_updates_request_timeout(20).pool_timeout(20).build()
 
     # Add command handlers
     bot_app.add_handler(CommandHandler("start", start_command))
@@ -615,4 +612,5 @@ async def stop_bot(bot_app):
             await bot_app.updater.stop()
         logger.info("Stopping the bot application...")
         await bot_app.stop()
+    await close_session()
     logger.info("Bot stopped successfully.")
\ No newline at end of file
@@ -1,94 +1,151 @@
 # db.py
 import logging
 import os
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+import threading
+from datetime import datetime, timezone
+from types import MappingProxyType
+from cachetools import TTLCache
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure, OperationFailure, PyMongoError
+from settings import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-_client = None
-_users_collection = None
-_log_collection = None
-_files_collection = None
+# Fields callers read from a file record
+FILE_INFO_PROJECTION = {"_id": 0, "file_hash": 1, "file_path": 1, "original_filename": 1, "thumbnail_path": 1}
+
+# Recently looked-up file records by hash, shared by the bot thread and the API
+_file_info_cache = TTLCache(maxsize=10_000, ttl=300)
+_file_info_cache_lock = threading.Lock()
+
+# One client per process: PyMongo clients must not be shared across fork()
+_clients = {}
+_connect_lock = threading.Lock()
 
 def connect_to_mongodb():
-    """Establishes a connection to MongoDB."""
-    global _client, _users_collection, _log_collection, _files_collection
-    MONGO_URI = os.getenv("MONGO_URI")
-    MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
-    MONGO_COLLECTION_NAME = os.getenv("MONGO_COLLECTION_NAME")
-    MONGO_LOG_COLLECTION_NAME = os.getenv("MONGO_LOG_COLLECTION_NAME")
-    MONGO_FILES_COLLECTION_NAME = os.getenv("MONGO_FILES_COLLECTION_NAME")
-
-    if _client:
-        return
+    """Establishes a connection to MongoDB and returns this process's client, or None if it can't be created."""
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is not None:
+        return client
+
+    # The bot thread and the FastAPI handlers may both try to connect first
+    with _connect_lock:
+        client = _clients.get(pid)
+        if client is not None:
+            return client
+
+        try:
+            client = MongoClient(settings.mongo_uri, maxPoolSize=50, minPoolSize=5)
+        except PyMongoError as e:
+            # e.g. a bad URI or an unresolvable SRV record; not cached, so the next call retries
+            logger.error(f"Failed to connect to MongoDB: {e}")
+            return None
+        _clients[pid] = client
+        try:
+            client.admin.command('ping')
+            logger.info("Successfully connected to MongoDB!")
+            _ensure_indexes(client[settings.mongo_db_name])
+        except ConnectionFailure as e:
+            logger.error(f"Failed to connect to MongoDB: {e}")
+        except OperationFailure as e:
+            logger.error(f"MongoDB operation failed: {e}")
+        return client
 
+def _ensure_indexes(db):
+    """Creates the indexes used by the hot lookups (no-op if they already exist)."""
     try:
-        _client = MongoClient(MONGO_URI)
-        db = _client[MONGO_DB_NAME]
-        _users_collection = db[MONGO_COLLECTION_NAME]
-        _log_collection = db[MONGO_LOG_COLLECTION_NAME]
-        _files_collection = db[MONGO_FILES_COLLECTION_NAME]
-        _client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB!")
-    except ConnectionFailure as e:
-        logger.error(f"Failed to connect to MongoDB: {e}")
+        # Not unique: the same file downloaded by two users is stored once per user
+        db[settings.mongo_files_collection_name].create_index([("file_hash", ASCENDING)])
+        db[settings.mongo_collection_name].create_index([("user_id", ASCENDING)])
+        db[settings.mongo_collection_name].create_index([("downloaded_files.file_hash", ASCENDING)])
+        db[settings.mongo_log_collection_name].create_index([("timestamp", DESCENDING)])
+        # Serves /logs?user_id=... filtered and sorted from the index alone
+        db[settings.mongo_log_collection_name].create_index([("user_id", ASCENDING), ("timestamp", DESCENDING)])
     except OperationFailure as e:
-        logger.error(f"MongoDB operation failed: {e}")
+        logger.error(f"Failed to create MongoDB indexes: {e}")
+
+def _get_collection(collection_name):
+    """Returns a collection from this process's client, or None if there is no connection."""
+    client = connect_to_mongodb()
+    if client is None:
+        return None
+    return client[settings.mongo_db_name][collection_name]
 
 def get_users_collection():
     """Returns the users collection."""
-    global _users_collection
-    if _users_collection is None:
-        connect_to_mongodb()
-    return _users_collection
+    return _get_collection(settings.mongo_collection_name)
 
 def get_log_collection():
     """Returns the log collection."""
-    global _log_collection
-    if _log_collection is None:
-        connect_to_mongodb()
-    return _log_collection
+    return _get_collection(settings.mongo_log_collection_name)
 
 def get_files_collection():
     """Returns the files collection."""
-    global _files_collection
-    if _files_collection is None:
-        connect_to_mongodb()
-    return _files_collection
+    return _get_collection(settings.mongo_files_collection_name)
 
 def add_file_info(file_hash, file_path, original_filename):
     """Adds file information to the database."""
+    add_file_infos([{
+        "file_hash": file_hash,
+        "file_path": file_path,
+        "original_filename": original_filename
+    }])
+
+def add_file_infos(file_infos):
+    """Adds several file information records to the database in a single round-trip."""
     files_collection = get_files_collection()
     if files_collection is None:
         logger.error("MongoDB connection not established. Cannot add file info.")
         return
 
-    file_data = {
-        "file_hash": file_hash,
-        "file_path": file_path,
-        "original_filename": original_filename,
-        "thumbnail_path": None
-    }
+    file_data = [
+        {
+            "file_hash": file_info["file_hash"],
+            "file_path": file_info["file_path"],
+            "original_filename": file_info["original_filename"],
+            "thumbnail_path": file_info.get("thumbnail_path")
+        }
+        for file_info in file_infos
+    ]
+    if not file_data:
+        return
 
     try:
-        files_collection.insert_one(file_data)
-        logger.info(f"Added file info to MongoDB: {file_hash} -> {original_filename}")
+        # Unordered so one failing record does not stop the rest of the batch
+        files_collection.insert_many(file_data, ordered=False)
+        for record in file_data:
+            _invalidate_file_info(record["file_hash"])
+            logger.info(f"Added file info to MongoDB: {record['file_hash']} -> {record['original_filename']}")
     except OperationFailure as e:
         logger.error(f"MongoDB operation failed: {e}")
 
+def _invalidate_file_info(file_hash):
+    """Drops a file record from the lookup cache after it changes."""
+    with _file_info_cache_lock:
+        _file_info_cache.pop(file_hash, None)
+
 def get_file_info_by_hash(file_hash):
-    """Retrieves file information from the database based on file hash."""
+    """Retrieves file information from the database based on file hash (cached, read-only)."""
+    with _file_info_cache_lock:
+        file_info = _file_info_cache.get(file_hash)
+    if file_info is not None:
+        return file_info
+
     files_collection = get_files_collection()
     if files_collection is None:
         logger.error("MongoDB connection not established. Cannot retrieve file info.")
         return None
 
     try:
-        file_info = files_collection.find_one({"file_hash": file_hash})
+        file_info = files_collection.find_one({"file_hash": file_hash}, FILE_INFO_PROJECTION)
         if file_info:
             logger.info(f"Retrieved file info from MongoDB for hash: {file_hash}")
+            # Every caller shares the cached record, so hand out a read-only view
+            file_info = MappingProxyType(file_info)
+            with _file_info_cache_lock:
+                _file_info_cache[file_hash] = file_info
             return file_info
         else:
             logger.warning(f"File info not found for hash: {file_hash}")
@@ -97,17 +154,48 @@ def get_file_info_by_hash(file_hash):
         logger.error(f"MongoDB operation failed: {e}")
         return None
     
-def add_user_downloaded_file(user_id, file_hash):
+def get_file_info_by_hashes(file_hashes):
+    """Retrieves file information for several file hashes in a single query."""
+    files_collection = get_files_collection()
+    if files_collection is None:
+        logger.error("MongoDB connection not established. Cannot retrieve file info.")
+        return None
+
+    file_hashes = list(file_hashes)
+    if not file_hashes:
+        return []
+
+    try:
+        files_by_hash = {}
+        for file_info in files_collection.find({"file_hash": {"$in": file_hashes}}, FILE_INFO_PROJECTION):
+            files_by_hash.setdefault(file_info["file_hash"], file_info)
+        # Preserve the order in which the hashes were requested
+        return [files_by_hash[file_hash] for file_hash in file_hashes if file_hash in files_by_hash]
+    except OperationFailure as e:
+        logger.error(f"MongoDB operation failed: {e}")
+        return None
+
+def add_user_downloaded_file(user_id, file_hash, file_path, original_filename):
     """Adds a downloaded file to the user's record in the database."""
     users_collection = get_users_collection()
     if users_collection is None:
         logger.error("MongoDB connection not established. Cannot add downloaded file to user.")
         return
 
+    # Keep the displayed file details on the user so listing files needs no join
+    file_entry = {
+        "file_hash": file_hash,
+        "file_path": file_path,
+        "original_filename": original_filename,
+        "thumbnail_path": None,
+        "downloaded_at": datetime.now(timezone.utc)
+    }
+
     try:
         users_collection.update_one(
-            {"user_id": user_id},
-            {"$addToSet": {"downloaded_files": file_hash}}
+            # Skip files the user already has, stored either as an entry or a bare hash
+            {"user_id": user_id, "downloaded_files": {"$ne": file_hash}, "downloaded_files.file_hash": {"$ne": file_hash}},
+            {"$push": {"downloaded_files": file_entry}}
         )
         logger.info(f"Added file {file_hash} to user {user_id}'s downloaded files.")
     except OperationFailure as e:
@@ -121,14 +209,25 @@ def get_file_info_by_user(user_id):
         return None
 
     try:
+        user_data = users_collection.find_one({"user_id": user_id}, {"_id": 0, "downloaded_files": 1})
+        if not user_data:
+            return []
+        downloaded_files = user_data.get("downloaded_files", [])
+
+        # Older records only store the file hash; resolve those in one $in query
+        legacy_hashes = [entry for entry in downloaded_files if isinstance(entry, str)]
+        legacy_files = {}
+        if legacy_hashes:
+            for file_info in get_file_info_by_hashes(legacy_hashes) or []:
+                legacy_files[file_info["file_hash"]] = file_info
+
         user_files = []
-        user_data = users_collection.find_one({"user_id": user_id})
-        if user_data and "downloaded_files" in user_data:
-            files_collection = get_files_collection()
-            for file_hash in user_data["downloaded_files"]:
-                file_info = files_collection.find_one({"file_hash": file_hash})
-                if file_info:
-                    user_files.append(file_info)
+        for entry in downloaded_files:
+            if isinstance(entry, str):
+                if entry in legacy_files:
+                    user_files.append(legacy_files[entry])
+            else:
+                user_files.append(entry)
         return user_files
     except OperationFailure as e:
         logger.error(f"MongoDB operation failed: {e}")
@@ -137,7 +236,8 @@ def get_file_info_by_user(user_id):
 def update_file_thumbnail(file_hash, thumbnail_path):
     """Updates the thumbnail path for a specific file."""
     files_collection = get_files_collection()
-    if files_collection is None:
+    users_collection = get_users_collection()
+    if files_collection is None or users_collection is None:
         logger.error("MongoDB connection not established. Cannot update file thumbnail.")
         return
 
@@ -146,16 +246,24 @@ def update_file_thumbnail(file_hash, thumbnail_path):
             {"file_hash": file_hash},
             {"$set": {"thumbnail_path": thumbnail_path}}
         )
+        _invalidate_file_info(file_hash)
         if result.modified_count > 0:
             logger.info(f"Updated thumbnail path for file {file_hash}")
         else:
             logger.warning(f"Failed to update thumbnail path for file {file_hash}")
+
+        # Keep the copies stored on user records in sync
+        users_collection.update_many(
+            {"downloaded_files.file_hash": file_hash},
+            {"$set": {"downloaded_files.$[entry].thumbnail_path": thumbnail_path}},
+            array_filters=[{"entry.file_hash": file_hash}]
+        )
     except OperationFailure as e:
         logger.error(f"MongoDB operation failed: {e}")
 
 def close_mongodb_connection():
     """Closes the MongoDB connection."""
-    global _client
-    if _client:
-        _client.close()
+    client = _clients.pop(os.getpid(), None)
+    if client:
+        client.close()
         logger.info("MongoDB connection closed.")
\ No newline at end of file
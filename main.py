@@ -2,20 +2,25 @@
 # (The code for main.py remains the same as in the previous version)
 import asyncio
 import uvicorn
-from fastapi import FastAPI, HTTPException, Depends, Request
-from threading import Thread
+from fastapi import FastAPI, HTTPException, Depends, Request, Query
+from threading import Thread, Event
 from bot import run_bot, stop_bot
-from db import get_log_collection, close_mongodb_connection, connect_to_mongodb, get_file_info_by_hash
+from settings import settings
+from db import get_log_collection, close_mongodb_connection, get_file_info_by_hash
 import logging
-import time
-from typing import List
+from typing import Optional
 from pymongo import DESCENDING
-from pymongo.errors import OperationFailure
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from pymongo.errors import PyMongoError
+from fastapi.security import HTTPBasicCredentials
 from starlette.status import HTTP_401_UNAUTHORIZED
-from starlette.responses import JSONResponse, FileResponse
+from starlette.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import secrets
+import orjson
+import base64
 import os
+import stat
+from pathlib import Path
 
 # Enable logging
 logging.basicConfig(
@@ -28,28 +33,37 @@ app = FastAPI()
 # Global variables to track the bot application and thread
 bot_app = None
 bot_thread = None
+# Event loop the bot runs on; teardown has to run there too
+bot_loop = None
+# Set by the bot thread once the bot is initialized and polling
+bot_ready = Event()
+BOT_START_TIMEOUT = 10  # seconds
 
-# HTTP Basic Authentication
-security = HTTPBasic()
+# Admin credentials, read once at startup and kept as bytes for compare_digest
+ADMIN_USERNAME = settings.admin_username.encode()
+ADMIN_PASSWORD = settings.admin_password.encode()
+
+# Files are only ever served from inside this directory
+DOWNLOAD_ROOT = settings.download_dir.resolve()
 
 def start_bot_in_thread():
-    global bot_app
+    global bot_app, bot_loop
     logger.info("Starting bot in a new thread...")
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    bot_loop = loop
 
     async def run_and_get_app():
         global bot_app
         bot_app = await run_bot()
+        bot_ready.set()
 
     loop.create_task(run_and_get_app())
     loop.run_forever()
+    loop.close()
 
 # Authentication function using HTTP Basic Auth
-async def authenticate_admin(credentials: HTTPBasicCredentials = Depends(security)):
-    ADMIN_USERNAME = os.getenv("ADMIN_USERNAME")
-    ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
-
+async def authenticate_admin(credentials: HTTPBasicCredentials):
     if not credentials or not credentials.username or not credentials.password:
         raise HTTPException(
             status_code=HTTP_401_UNAUTHORIZED,
@@ -57,8 +71,8 @@ async def authenticate_admin(credentials: HTTPBasicCredentials = Depends(securit
             headers={"WWW-Authenticate": "Basic"},
         )
 
-    correct_username = secrets.compare_digest(credentials.username, ADMIN_USERNAME)
-    correct_password = secrets.compare_digest(credentials.password, ADMIN_PASSWORD)
+    correct_username = secrets.compare_digest(credentials.username.encode(), ADMIN_USERNAME)
+    correct_password = secrets.compare_digest(credentials.password.encode(), ADMIN_PASSWORD)
 
     if not (correct_username and correct_password):
         raise HTTPException(
@@ -68,6 +82,27 @@ async def authenticate_admin(credentials: HTTPBasicCredentials = Depends(securit
         )
     return credentials.username
 
+def parse_basic_auth(auth_header: str) -> HTTPBasicCredentials:
+    """Decodes a Basic Authorization header into credentials."""
+    scheme, _, encoded = auth_header.partition(" ")
+    try:
+        if scheme.lower() != "basic":
+            raise ValueError("Unsupported authorization scheme")
+        username, separator, password = base64.b64decode(encoded).decode("utf-8").partition(":")
+        if not separator:
+            raise ValueError("Missing password separator")
+    except ValueError:
+        raise HTTPException(
+            status_code=HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Basic"},
+        )
+    return HTTPBasicCredentials(username=username, password=password)
+
+def get_admin_username(request: Request) -> str:
+    """Returns the admin username already verified by the authentication middleware."""
+    return request.state.username
+
 # Apply authentication to all routes
 @app.middleware("http")
 async def apply_authentication(request: Request, call_next):
@@ -86,8 +121,8 @@ async def apply_authentication(request: Request, call_next):
                 headers={"WWW-Authenticate": "Basic"},
             )
 
-        # Check authentication using the dependency
-        credentials = await security(request)
+        # Decode the header directly rather than going through the HTTPBasic dependency
+        credentials = parse_basic_auth(auth_header)
         username = await authenticate_admin(credentials)
         request.state.username = username
     except HTTPException as e:
@@ -108,18 +143,21 @@ def read_root():
     return {"message": "Welcome to the API"}
 
 @app.get("/botstart")
-async def start_bot_endpoint(username: str = Depends(authenticate_admin)):
+async def start_bot_endpoint(username: str = Depends(get_admin_username)):
     """Starts the Telegram bot if it's not already running."""
     global bot_thread
     logger.info(f"Received request at /botstart from {username}")
 
     if bot_thread is None or not bot_thread.is_alive():
+        bot_ready.clear()
         bot_thread = Thread(target=start_bot_in_thread)
         bot_thread.start()
         logger.info("Bot start initiated.")
 
-        # Wait for a few seconds to ensure the bot and MongoDB connection are ready
-        time.sleep(5)
+        # Wait for the bot and MongoDB connection to be ready without blocking the event loop
+        if not await run_in_threadpool(bot_ready.wait, BOT_START_TIMEOUT):
+            logger.warning(f"Bot did not report ready within {BOT_START_TIMEOUT} seconds.")
+            return {"message": "Bot start initiated but it is not ready yet"}
 
         return {"message": "Bot started successfully"}
     else:
@@ -127,23 +165,27 @@ async def start_bot_endpoint(username: str = Depends(authenticate_admin)):
         return {"message": "Bot is already running"}
 
 @app.get("/botstop")
-async def stop_bot_endpoint(username: str = Depends(authenticate_admin)):
+async def stop_bot_endpoint(username: str = Depends(get_admin_username)):
     """Stops the Telegram bot if it's running."""
     global bot_app
     global bot_thread
+    global bot_loop
     logger.info(f"Received request at /botstop from {username}")
 
     if bot_app and bot_thread and bot_thread.is_alive():
         try:
-            loop = asyncio.new_event_loop()
-            loop.run_until_complete(stop_bot(bot_app))
+            # Stop the bot on its own loop, where its sessions and tasks live, then end that loop
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(stop_bot(bot_app), bot_loop))
+            bot_loop.call_soon_threadsafe(bot_loop.stop)
 
             # Close MongoDB connection
             close_mongodb_connection()
 
-            bot_thread.join()
+            await run_in_threadpool(bot_thread.join)
+            bot_ready.clear()
             bot_app = None
             bot_thread = None
+            bot_loop = None
             logger.info("Bot stop initiated.")
             return {"message": "Bot stopped successfully"}
         except Exception as e:
@@ -154,36 +196,71 @@ async def stop_bot_endpoint(username: str = Depends(authenticate_admin)):
         return {"message": "Bot is not running"}
 
 # API endpoint to get user activity logs (admin only)
-@app.get("/logs", response_model=List[dict])
-async def get_logs(username: str = Depends(authenticate_admin)):
-    """Retrieves user activity logs from MongoDB (admin only)."""
+@app.get("/logs")
+async def get_logs(
+    limit: int = Query(500, ge=1, le=10000),
+    user_id: Optional[int] = None,
+    username: str = Depends(get_admin_username),
+):
+    """Streams user activity logs from MongoDB as NDJSON, newest first (admin only)."""
     logger.info(f"Admin {username} requested logs at /logs")
 
-    log_collection = get_log_collection()
+    # PyMongo is blocking, so keep it off the event loop
+    log_collection = await run_in_threadpool(get_log_collection)
     if log_collection is None:
         logger.error("MongoDB connection not established. Cannot retrieve logs.")
         raise HTTPException(status_code=500, detail="Database connection not available")
 
+    query = {"user_id": user_id} if user_id is not None else {}
+    # Leave out the ObjectId _id so the documents serialize as-is
+    cursor = log_collection.find(query, {"_id": 0}).sort("timestamp", DESCENDING).limit(limit).batch_size(500)
     try:
-        logs = list(log_collection.find().sort("timestamp", DESCENDING))
-        # Convert ObjectId to string for JSON serialization
-        for log in logs:
-            log["_id"] = str(log["_id"])
-        return logs
-    except OperationFailure as e:
+        # Run the query before responding so failures still return a 500
+        first_log = await run_in_threadpool(next, cursor, None)
+    except PyMongoError as e:
         logger.error(f"MongoDB operation failed: {e}")
+        cursor.close()
         raise HTTPException(status_code=500, detail="Failed to retrieve logs")
 
+    def stream_logs():
+        # Starlette iterates this generator in its threadpool, one document per line.
+        # default=str covers BSON types orjson doesn't know, like ObjectId or Decimal128.
+        try:
+            if first_log is not None:
+                yield orjson.dumps(first_log, default=str) + b"\n"
+            for log in cursor:
+                yield orjson.dumps(log, default=str) + b"\n"
+        except PyMongoError as e:
+            # The 200 status is already sent, so end with an error line rather than a silently short body
+            logger.error(f"MongoDB operation failed while streaming logs: {e}")
+            yield orjson.dumps({"error": "Failed to retrieve all logs"}) + b"\n"
+        finally:
+            cursor.close()
+
+    return StreamingResponse(stream_logs(), media_type="application/x-ndjson")
+
 @app.get("/download/{file_hash}")
 async def download_file(file_hash: str):
     """Serve files from the user's download directory based on file hash."""
-    file_info = get_file_info_by_hash(file_hash)
+    file_info = await run_in_threadpool(get_file_info_by_hash, file_hash)
     if not file_info:
         logger.error(f"File not found for hash: {file_hash}")
         raise HTTPException(status_code=404, detail="File not found")
 
-    file_path = file_info["file_path"]
-    if not os.path.isfile(file_path):
+    # Resolving follows symlinks on disk, so keep it off the event loop like the lookup above
+    file_path = await run_in_threadpool(Path(file_info["file_path"]).resolve)
+    if not file_path.is_relative_to(DOWNLOAD_ROOT):
+        logger.error(f"Refusing to serve file outside the download directory: {file_path}")
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # Stat once and hand the result to FileResponse so it doesn't stat the file again
+    try:
+        file_stat = await run_in_threadpool(file_path.stat)
+    except OSError as e:
+        # Missing, unreadable or otherwise unusable paths (e.g. a file where a directory should be) are a 404
+        logger.error(f"Could not stat {file_path}: {e}")
+        file_stat = None
+    if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
         logger.error(f"File not found: {file_path}")
         raise HTTPException(status_code=404, detail="File not found")
 
@@ -192,7 +269,7 @@ async def download_file(file_hash: str):
         "Content-Disposition": f"attachment; filename*=UTF-8''{file_info['original_filename']}"
     }
 
-    return FileResponse(file_path, headers=headers, filename=file_info["original_filename"])
+    return FileResponse(file_path, headers=headers, filename=file_info["original_filename"], stat_result=file_stat)
 
 if __name__ == "__main__":
     logger.info("Starting FastAPI application...")
@@ -1,8 +1,7 @@
 # premium.py
 import aiohttp
 import aiofiles
-from aiofiles.threadpool.binary import AsyncFileIO
-from tqdm.asyncio import tqdm
+import aiofiles.os
 from pathlib import Path
 import logging
 import os
@@ -11,33 +10,110 @@ from telegram import Update, Message
 from telegram.ext import ContextTypes
 import re
 import hashlib
-from db import add_file_info, update_file_thumbnail
+import io
+from db import add_file_info
+from settings import settings
 import ffmpeg
 import magic
 import math
 import asyncio
+import contextlib
+import errno
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from urllib.parse import unquote, urlparse
 
 logger = logging.getLogger(__name__)
 
 FILE_SIZE_LIMIT = 50 * 1024 * 1024  # 50 MB
+PROGRESS_UPDATE_INTERVAL = 1.0  # Seconds between progress edits; each edit is awaited, so this stays at or under Telegram's ~1/s limit
+READ_BUFSIZE = 10 * 1024 * 1024  # aiohttp stream buffer, so each read can hand over several MiB at once
+WRITE_BATCH_SIZE = 4 * 1024 * 1024  # Bytes collected before one writev call
+WRITE_BATCH_MAX_BUFFERS = 512  # Keeps each writev call well under the kernel's IOV_MAX
+# No overall limit, since large downloads legitimately take long; a stalled socket still fails
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=30, sock_connect=30, sock_read=300)
+FFPROBE_TIMEOUT = 30  # Seconds before a stuck ffprobe is killed
+FFMPEG_TIMEOUT = 120  # Seconds before a stuck thumbnail ffmpeg is killed
+
+# Filename in a Content-Disposition header: the RFC 5987 encoded form, then the plain quoted or bare form
+_CONTENT_DISPOSITION_RE = re.compile(r"filename\*=UTF-8''([^;]+)", re.IGNORECASE)
+_CONTENT_DISPOSITION_PLAIN_RE = re.compile(r'filename="?([^";]+)"?', re.IGNORECASE)
+
+# Loading the magic database is expensive, so share one instance (it locks internally)
+_MAGIC = magic.Magic(mime=True)
+
+# Limits how many ffmpeg processes run at the same time; created per event loop, like the session
+FFMPEG_CONCURRENCY = max(1, (os.cpu_count() or 2) // 2)
+_ffmpeg_semaphore = None
+_ffmpeg_semaphore_loop = None
+
+# Disk writes from all concurrent downloads share these few threads instead of
+# competing with the rest of the bot for the default executor
+_DISK_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="download-writer")
+
+# Shared HTTP session, so downloads reuse pooled keep-alive connections and cached DNS
+_session = None
+_session_loop = None
+
+# User download directories already created by this process
+_known_user_dirs = set()
+
+def sanitize_filename(file_name, default="download"):
+    """Strips any directory components so the filename cannot escape its directory."""
+    file_name = file_name.replace("\\", "/").rsplit("/", 1)[-1].strip()
+    if file_name in ("", ".", ".."):
+        return default
+    return file_name
 
 def guess_mime_type_from_header(file_path):
     """Guesses the MIME type of a file based on its header (magic number)."""
     try:
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_file(file_path)
+        mime_type = _MAGIC.from_file(file_path)
         return mime_type
     except magic.MagicException as e:
         logger.error(f"Error guessing MIME type from header: {e}")
         return None
 
+def _get_ffmpeg_semaphore():
+    """Returns the semaphore bounding concurrent ffmpeg runs on the running event loop."""
+    global _ffmpeg_semaphore, _ffmpeg_semaphore_loop
+    loop = asyncio.get_running_loop()
+    # A semaphore binds to the loop it first blocks on, so a restarted bot needs a fresh one;
+    # nothing on the new loop can be holding the old one
+    if _ffmpeg_semaphore is None or _ffmpeg_semaphore_loop is not loop:
+        _ffmpeg_semaphore = asyncio.Semaphore(FFMPEG_CONCURRENCY)
+        _ffmpeg_semaphore_loop = loop
+    return _ffmpeg_semaphore
+
+async def _communicate(process, timeout):
+    """Waits for a subprocess to finish, killing it if it runs past the timeout."""
+    try:
+        return await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+
+async def _aprobe(path):
+    """Runs ffprobe without blocking the event loop and returns its parsed JSON output."""
+    process = await asyncio.create_subprocess_exec(
+        "ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await _communicate(process, FFPROBE_TIMEOUT)
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffprobe', stdout, stderr)
+    return orjson.loads(stdout)
+
 async def create_video_thumbnail_sheet_async(video_path, thumbnail_path, num_frames=12):
     """
     Creates a thumbnail sheet from a video file using ffmpeg asynchronously.
     """
     try:
         # Get video duration
-        probe = ffmpeg.probe(video_path)
+        probe = await _aprobe(video_path)
         duration = float(probe['format']['duration'])
 
         # Calculate interval between frames
@@ -54,27 +130,35 @@ async def create_video_thumbnail_sheet_async(video_path, thumbnail_path, num_fra
             cols = 4
             rows = math.ceil(num_frames / cols)
 
-        # Generate thumbnail sheet using a filter_complex expression
-        select_expr = "+".join([f"eq(t,{i * interval})" for i in range(num_frames)])
+        # Seek each input straight to its timestamp so ffmpeg decodes one frame per tile
+        # instead of the whole video, then stitch the frames into a single sheet
+        seek_args = []
+        frame_filters = []
+        for i in range(num_frames):
+            seek_args += ["-ss", f"{i * interval:.3f}", "-i", video_path]
+            frame_filters.append(f"[{i}:v]trim=end_frame=1,setpts=PTS-STARTPTS,scale=320:-1[f{i}]")
+        frame_labels = "".join(f"[f{i}]" for i in range(num_frames))
+        filter_complex = ";".join(frame_filters) + f";{frame_labels}concat=n={num_frames}:v=1:a=0,tile={cols}x{rows}[out]"
 
         # Convert thumbnail_path to an absolute path
         thumbnail_path_absolute = os.path.abspath(thumbnail_path)
         logger.info(f"Creating thumbnail sheet at: {thumbnail_path_absolute}")
 
-        # Run FFmpeg asynchronously
-        process = await asyncio.create_subprocess_exec(
-            "ffmpeg",
-            "-i", video_path,
-            "-filter_complex", f"[0:v]select='{select_expr}',scale=320:-1,tile={cols}x{rows}[out]",
-            "-map", "[out]",
-            "-vframes", "1",
-            thumbnail_path_absolute,
-            "-y",
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
+        # Run FFmpeg asynchronously, but only a few at once so concurrent uploads don't saturate the CPU
+        async with _get_ffmpeg_semaphore():
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg",
+                *seek_args,
+                "-filter_complex", filter_complex,
+                "-map", "[out]",
+                "-vframes", "1",
+                thumbnail_path_absolute,
+                "-y",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
 
-        stdout, stderr = await process.communicate()
+            stdout, stderr = await _communicate(process, FFMPEG_TIMEOUT)
 
         if process.returncode != 0:
             logger.error(f"Error creating thumbnail sheet for {video_path}:")
@@ -86,7 +170,7 @@ async def create_video_thumbnail_sheet_async(video_path, thumbnail_path, num_fra
             )
 
         # Log thumbnail sheet dimensions
-        probe = ffmpeg.probe(thumbnail_path_absolute)
+        probe = await _aprobe(thumbnail_path_absolute)
         video_stream = next((stream for stream in probe['streams'] if stream['codec_type'] == 'video'), None)
         if video_stream:
             width = int(video_stream['width'])
@@ -101,149 +185,326 @@ async def create_video_thumbnail_sheet_async(video_path, thumbnail_path, num_fra
         logger.error(f"Error creating thumbnail sheet for {video_path}: {e.stderr.decode()}")
         raise
 
+def _get_session():
+    """Returns the shared aiohttp session, creating it on first use."""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    # A restarted bot runs on a new event loop, which can't use the old loop's connections;
+    # close_session() on the old loop is the only teardown, so refuse rather than leak it
+    if _session is not None and not _session.closed and _session_loop is not loop:
+        raise RuntimeError("Download session is still open on another event loop; close_session() must run before the bot restarts")
+    # No await between the check and the assignment, so no lock is needed
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=32, ttl_dns_cache=600, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(connector=connector, timeout=DOWNLOAD_TIMEOUT, read_bufsize=READ_BUFSIZE)
+        _session_loop = loop
+    return _session
+
+async def close_session():
+    """Closes the shared aiohttp session; must run on the event loop that created it."""
+    global _session, _session_loop
+    if _session is not None:
+        if _session_loop is not asyncio.get_running_loop():
+            raise RuntimeError("close_session() must run on the event loop that created the session")
+        await _session.close()
+        _session = None
+        _session_loop = None
+
+def _handle_edit_error(exc: BadRequest, message_id: int):
+    """Logs a rejected message edit at a level matching how expected the failure is."""
+    message = exc.message or ""
+    if "Message is not modified" in message:
+        logger.info(f"Message {message_id} not modified - progress likely the same.")
+    elif "Message can't be edited" in message:
+        logger.warning(f"Could not edit message {message_id} - likely too old or deleted.")
+    else:
+        logger.error(f"Error editing message: {message}")
+
+async def _edit_progress_message(context: ContextTypes.DEFAULT_TYPE, processing_message: Message, text: str):
+    """Edits the processing message, logging instead of raising on failure."""
+    try:
+        await context.bot.edit_message_text(
+            chat_id=processing_message.chat_id,
+            message_id=processing_message.message_id,
+            text=text
+        )
+        return True
+    except BadRequest as e:
+        _handle_edit_error(e, processing_message.message_id)
+    except Exception as e:
+        logger.error(f"An unexpected error occurred while editing message: {e}")
+    return False
+
+async def _progress_loop(context: ContextTypes.DEFAULT_TYPE, processing_message: Message, state: dict, total_size: int):
+    """Reports download progress once per interval until cancelled."""
+    last_progress = 0
+    while True:
+        await asyncio.sleep(PROGRESS_UPDATE_INTERVAL)
+        progress = state["downloaded"] * 100 // total_size
+        # Editing to the same text is rejected by Telegram, so skip unchanged percentages
+        if progress != last_progress and progress < 100:
+            if await _edit_progress_message(context, processing_message, f"Downloading: {progress}%"):
+                last_progress = progress
+
+def _preallocate(fd, size):
+    """Reserves disk space for a download up front so the filesystem can allocate it contiguously."""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except AttributeError:
+        # posix_fallocate is missing on some platforms; extending the file still avoids per-write growth
+        os.ftruncate(fd, size)
+    except OSError as e:
+        # The filesystem can't preallocate; anything else, like a full disk, should fail the download now
+        if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+            raise
+        os.ftruncate(fd, size)
+
+def _hash_and_write(fd, buffers, file_hash):
+    """Adds a batch of chunks to the running hash and writes them to fd with writev."""
+    for buffer in buffers:
+        file_hash.update(buffer)
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        written = os.writev(fd, views)
+        # writev may stop early; skip the fully written buffers and resume mid-buffer
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if views and written:
+            views[0] = views[0][written:]
+
+async def _read_into_memory(response, progress_state: dict):
+    """Reads the whole response body into memory."""
+    buffer = io.BytesIO()
+    async for chunk in response.content.iter_any():
+        buffer.write(chunk)
+        progress_state["downloaded"] += len(chunk)
+    return buffer.getvalue()
+
+async def _stream_to_file(response, file_path, total_size: int, progress_state: dict):
+    """Streams the response body to file_path, returning its SHA-256 hex digest."""
+    file_hash = hashlib.sha256()
+    fd = await asyncio.to_thread(os.open, file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    loop = asyncio.get_running_loop()
+    flush_future = None
+    try:
+        if total_size > 0:
+            await asyncio.to_thread(_preallocate, fd, total_size)
+        # Batch chunks so each worker-thread hop hashes and writes several MiB at once
+        pending = []
+        pending_bytes = 0
+        # Take whatever aiohttp has buffered rather than reslicing it into fixed-size chunks
+        async for chunk in response.content.iter_any():
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            progress_state["downloaded"] += len(chunk)
+            if pending_bytes >= WRITE_BATCH_SIZE or len(pending) >= WRITE_BATCH_MAX_BUFFERS:
+                # Write this batch while the next one downloads; one flush at a time keeps writes in order
+                if flush_future is not None:
+                    await flush_future
+                flush_future = loop.run_in_executor(_DISK_EXECUTOR, _hash_and_write, fd, pending, file_hash)
+                pending = []
+                pending_bytes = 0
+        if flush_future is not None:
+            await flush_future
+        if pending:
+            await loop.run_in_executor(_DISK_EXECUTOR, _hash_and_write, fd, pending, file_hash)
+        # Drop any preallocated space the download didn't fill
+        await asyncio.to_thread(os.ftruncate, fd, progress_state["downloaded"])
+    finally:
+        # Never close the fd under a write that is still running
+        if flush_future is not None and not flush_future.done():
+            await asyncio.wait([flush_future])
+        os.close(fd)
+    return file_hash.hexdigest()
+
+async def _download_with_progress(response, total_size: int, context: ContextTypes.DEFAULT_TYPE, processing_message: Message, file_path=None):
+    """Downloads the response to file_path, or into memory if none is given, returning the SHA-256 digest and any in-memory bytes."""
+    # Progress edits run in their own task so the download loop never waits on Telegram
+    progress_state = {"downloaded": 0}
+    progress_task = None
+    if total_size > 0:
+        progress_task = asyncio.create_task(_progress_loop(context, processing_message, progress_state, total_size))
+    try:
+        if file_path is None:
+            file_content = await _read_into_memory(response, progress_state)
+        else:
+            file_content = None
+            file_hash_str = await _stream_to_file(response, file_path, total_size, progress_state)
+    finally:
+        if progress_task is not None:
+            progress_task.cancel()
+
+    # Send the final edit while the download is hashed, rather than waiting on Telegram first
+    complete_edit = None
+    if total_size > 0 and progress_state["downloaded"] >= total_size:
+        complete_edit = asyncio.create_task(_edit_progress_message(context, processing_message, "Download complete!"))
+
+    if file_content is not None:
+        # Hash the whole buffer in one call; the caller writes it to disk while sending it
+        file_hash_str = await asyncio.to_thread(lambda: hashlib.sha256(file_content).hexdigest())
+    # Finish before returning so this edit can't overwrite the caller's next one
+    if complete_edit is not None:
+        await complete_edit
+    return file_hash_str, file_content
+
+async def _persist_download(file_content: bytes, temp_file_path, final_file_path):
+    """Writes an in-memory download to disk and moves it into place."""
+    async with aiofiles.open(temp_file_path, 'wb') as temp_file:
+        await temp_file.write(file_content)
+    os.replace(temp_file_path, final_file_path)
+
 async def download_file_from_premium_to(url: str, user_id: int, api_key: str, user_premium_id: str, download_dir: str, update: Update, context: ContextTypes.DEFAULT_TYPE, processing_message: Message):
     """Downloads a file from a given URL using the Premium.to API."""
-    last_progress_update = 0
-
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get('http://api.premium.to/api/2/getfile.php', params={
-                'userid': user_premium_id,
-                'apikey': api_key,
-                'link': url
-            }) as response:
-                if response.status == 200:
-                    if response.headers.get('Content-Type') == 'application/octet-stream':
-                        try:
-                            total_size = int(response.headers.get('Content-Length', 0))
-                            user_dir = Path(download_dir) / str(user_id)
-                            user_dir.mkdir(parents=True, exist_ok=True)
-
-                            content_disposition = response.headers.get('Content-Disposition', '')
-                            match = re.search(r"filename\*=UTF-8''(.+)", content_disposition)
-                            if match:
-                                file_name = match.group(1)
-                            else:
-                                file_name = os.path.basename(url)
+        async with _get_session().get('http://api.premium.to/api/2/getfile.php', params={
+            'userid': user_premium_id,
+            'apikey': api_key,
+            'link': url
+        }) as response:
+            if response.status == 200:
+                if response.headers.get('Content-Type') == 'application/octet-stream':
+                    temp_file_path = None
+                    try:
+                        total_size = int(response.headers.get('Content-Length', 0))
+                        # Large files are served by the file host, so don't download one that can't be served
+                        if total_size >= FILE_SIZE_LIMIT and not settings.file_host_base_url:
+                            logger.error("Error: FILE_HOST_BASE_URL environment variable not set.")
+                            await processing_message.edit_text("Error: Large file downloads are not configured.")
+                            return None
+                        user_dir = Path(download_dir) / str(user_id)
+                        if user_dir not in _known_user_dirs:
+                            await aiofiles.os.makedirs(user_dir, exist_ok=True)
+                            _known_user_dirs.add(user_dir)
 
-                            try:
-                                file_name = file_name.encode('latin1').decode('utf-8')
-                            except UnicodeEncodeError:
-                                pass
-
-                            file_hash = hashlib.sha256()
-                            async with aiofiles.open(user_dir / "tempfile", 'wb') as temp_file:
-                                chunk_size = 4096
-                                downloaded_size = 0
-                                async for chunk in response.content.iter_chunked(chunk_size):
-                                    if chunk:
-                                        await temp_file.write(chunk)
-                                        file_hash.update(chunk)
-                                        downloaded_size += len(chunk)
-                                        progress = int((downloaded_size / total_size) * 100) if total_size > 0 else 0
-                                        if progress >= last_progress_update + 5 and progress < 100:
-                                            try:
-                                                await context.bot.edit_message_text(
-                                                    chat_id=processing_message.chat_id,
-                                                    message_id=processing_message.message_id,
-                                                    text=f"Downloading: {progress}%"
-                                                )
-                                                last_progress_update = progress
-                                            except BadRequest as e:
-                                                if "Message is not modified" in str(e):
-                                                    logger.info(f"Message {processing_message.message_id} not modified - progress likely the same.")
-                                                elif "Message can't be edited" in str(e):
-                                                    logger.warning(f"Could not edit message {processing_message.message_id} - likely too old or deleted.")
-                                                else:
-                                                    logger.error(f"Error editing message: {e}")
-                                            except Exception as e:
-                                                logger.error(f"An unexpected error occurred while editing message: {e}")
-                                        elif progress == 100:
-                                            await context.bot.edit_message_text(
-                                                chat_id=processing_message.chat_id,
-                                                message_id=processing_message.message_id,
-                                                text=f"Download complete!"
-                                            )
-
-                            file_hash_str = file_hash.hexdigest()
-                            final_file_path = user_dir / file_hash_str
-                            os.rename(user_dir / "tempfile", final_file_path)
+                        content_disposition = response.headers.get('Content-Disposition', '')
+                        # Prefer the encoded form when a server sends both, as RFC 6266 recommends;
+                        # it and the URL path are percent-encoded UTF-8, the plain form is used as sent
+                        encoded_match = _CONTENT_DISPOSITION_RE.search(content_disposition)
+                        plain_match = None if encoded_match else _CONTENT_DISPOSITION_PLAIN_RE.search(content_disposition)
+                        if encoded_match:
+                            file_name = unquote(encoded_match.group(1).strip())
+                        elif plain_match:
+                            file_name = plain_match.group(1).strip()
+                        else:
+                            file_name = unquote(urlparse(url).path.rsplit('/', 1)[-1])
+                        file_name = sanitize_filename(file_name)
 
+                        # Unique per download so concurrent downloads by the same user don't collide
+                        temp_file_path = user_dir / f"tmp-{uuid.uuid4().hex}"
+                        # Small files are kept in memory only; they are sent from there and written
+                        # to disk alongside the upload instead of being written and read back
+                        in_memory = 0 < total_size < FILE_SIZE_LIMIT
+                        file_hash_str, file_content = await _download_with_progress(
+                            response, total_size, context, processing_message,
+                            file_path=None if in_memory else temp_file_path
+                        )
+                        final_file_path = user_dir / file_hash_str
+                        persist_task = None
+                        persisted = True
+                        if file_content is None:
+                            os.replace(temp_file_path, final_file_path)
+                            temp_file_path = None
                             add_file_info(file_hash_str, str(final_file_path), file_name)
 
-                            if total_size < FILE_SIZE_LIMIT:
-                                with open(final_file_path, 'rb') as f:
-                                    try:
-                                        file_doc = await context.bot.send_document(
-                                            chat_id=processing_message.chat_id,
-                                            document=f,
-                                            caption="Here is your file!",
-                                            filename=file_name,
-                                            read_timeout=30,
-                                            write_timeout=30,
-                                            connect_timeout=30
-                                        )
-                                    except TimedOut as e:
-                                        logger.error(f"Telegram API timed out while sending document: {e}")
-                                        return None
-
-                                file_id = file_doc.document.file_id
-                                file_path_on_telegram = await context.bot.get_file(file_id)
-                                file_url_on_telegram = f"https://api.telegram.org/file/bot{os.getenv('TELEGRAM_BOT_TOKEN')}/{file_path_on_telegram.file_path}"
-
-                                logger.info(f"File sent directly to user {user_id}")
-                                return {
-                                    "file_hash": file_hash_str,
-                                    "file_url": file_url_on_telegram
-                                }
+                        if total_size < FILE_SIZE_LIMIT:
+                            if file_content is None:
+                                # Read the file off the event loop; PTB would read an open file synchronously
+                                async with aiofiles.open(final_file_path, 'rb') as f:
+                                    file_content = await f.read()
                             else:
-                                file_host_base_url = os.getenv("FILE_HOST_BASE_URL")
-                                if file_host_base_url:
-                                    file_url = f"{file_host_base_url}/download/{file_hash_str}"
-                                    logger.info(f"File link sent to user {user_id}")
-                                    return {
-                                        "file_hash": file_hash_str,
-                                        "file_url": file_url
-                                    }
-                                else:
-                                    logger.error("Error: FILE_HOST_BASE_URL environment variable not set.")
-                                    return None
-                        except Exception as e:
-                            logger.error(f"Error during download or sending file: {e}")
-                            return None
-                    else:
-                        try:
-                            api_response = await response.json()
-                            if "code" in api_response:
-                                error_code = api_response["code"]
-                                error_message = api_response.get("message", "Unknown error")
-                                error_messages = {
-                                    400: "Invalid parameters",
-                                    401: "Invalid API authentication",
-                                    402: "Filehost is not supported",
-                                    403: "Not enough traffic",
-                                    404: "File not found",
-                                    429: "Too many open connections",
-                                    500: "Currently no available premium account for this filehost",
-                                }
-                                error_msg = error_messages.get(error_code, f"Unknown error (code {error_code})")
-                                await processing_message.edit_text(f"Error: {error_msg}")
-                                logger.error(f"Premium.to API error: {error_msg}")
+                                # Upload to Telegram while the in-memory download is written to disk
+                                persist_task = asyncio.create_task(_persist_download(file_content, temp_file_path, final_file_path))
+                            try:
+                                await context.bot.send_document(
+                                    chat_id=processing_message.chat_id,
+                                    document=file_content,
+                                    caption="Here is your file!",
+                                    filename=file_name,
+                                    read_timeout=30,
+                                    write_timeout=30,
+                                    connect_timeout=30
+                                )
+                            except TimedOut as e:
+                                logger.error(f"Telegram API timed out while sending document: {e}")
                                 return None
-                        except aiohttp.ContentTypeError:
-                            logger.error(f"Failed to decode JSON response: {await response.text()}")
-                            await processing_message.edit_text("Error: Invalid response from Premium.to API.")
-                            return None
-                elif response.status == 302:
-                    redirect_url = response.headers.get('Location')
-                    logger.info(f"Received redirect to: {redirect_url}")
-                    await processing_message.edit_text(f"Download redirected to: {redirect_url}")
-                    return None
+                            finally:
+                                # The file is kept and recorded even when sending it failed
+                                if persist_task is not None:
+                                    try:
+                                        await persist_task
+                                    except OSError as e:
+                                        # The upload doesn't depend on the local copy, so this must not fail
+                                        # the download or hide an error from send_document
+                                        logger.error(f"Failed to save {file_hash_str} to disk: {e}")
+                                        persisted = False
+                                        with contextlib.suppress(OSError):
+                                            os.remove(temp_file_path)
+                                    else:
+                                        add_file_info(file_hash_str, str(final_file_path), file_name)
+                                    temp_file_path = None
+
+                            # The file is already in the chat; link to our own host rather than a
+                            # get_file round-trip for a Telegram URL that embeds the bot token
+                            file_url = None
+                            if persisted and settings.file_host_base_url:
+                                file_url = f"{settings.file_host_base_url}/download/{file_hash_str}"
+
+                            logger.info(f"File sent directly to user {user_id}")
+                            return {
+                                "file_hash": file_hash_str,
+                                "file_path": str(final_file_path),
+                                "original_filename": file_name,
+                                "file_url": file_url
+                            }
+                        else:
+                            file_url = f"{settings.file_host_base_url}/download/{file_hash_str}"
+                            logger.info(f"File link sent to user {user_id}")
+                            return {
+                                "file_hash": file_hash_str,
+                                "file_path": str(final_file_path),
+                                "original_filename": file_name,
+                                "file_url": file_url
+                            }
+                    except Exception as e:
+                        logger.error(f"Error during download or sending file: {e}")
+                        if temp_file_path is not None:
+                            with contextlib.suppress(FileNotFoundError):
+                                os.remove(temp_file_path)
+                        return None
                 else:
-                    error_msg = f"Error: Premium.to API returned status code {response.status}"
-                    await processing_message.edit_text(error_msg)
-                    logger.error(error_msg)
-                    return None
+                    try:
+                        api_response = orjson.loads(await response.read())
+                        if "code" in api_response:
+                            error_code = api_response["code"]
+                            error_message = api_response.get("message", "Unknown error")
+                            error_messages = {
+                                400: "Invalid parameters",
+                                401: "Invalid API authentication",
+                                402: "Filehost is not supported",
+                                403: "Not enough traffic",
+                                404: "File not found",
+                                429: "Too many open connections",
+                                500: "Currently no available premium account for this filehost",
+                            }
+                            error_msg = error_messages.get(error_code, f"Unknown error (code {error_code})")
+                            await processing_message.edit_text(f"Error: {error_msg}")
+                            logger.error(f"Premium.to API error: {error_msg}")
+                            return None
+                    except orjson.JSONDecodeError:
+                        logger.error(f"Failed to decode JSON response: {await response.text()}")
+                        await processing_message.edit_text("Error: Invalid response from Premium.to API.")
+                        return None
+            elif response.status == 302:
+                redirect_url = response.headers.get('Location')
+                logger.info(f"Received redirect to: {redirect_url}")
+                await processing_message.edit_text(f"Download redirected to: {redirect_url}")
+                return None
+            else:
+                error_msg = f"Error: Premium.to API returned status code {response.status}"
+                await processing_message.edit_text(error_msg)
+                logger.error(error_msg)
+                return None
 
     except Exception as e:
         error_msg = f"Error calling Premium.to API: {e}"
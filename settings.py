@@ -0,0 +1,67 @@
+# settings.py
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from dotenv import load_dotenv
+
+# Load environment variables from .env before anything reads them
+load_dotenv()
+
+# Environment variables the application cannot run without
+REQUIRED_VARIABLES = (
+    "TELEGRAM_BOT_TOKEN",
+    "DOWNLOAD_DIR",
+    "MONGO_URI",
+    "MONGO_DB_NAME",
+    "MONGO_COLLECTION_NAME",
+    "MONGO_LOG_COLLECTION_NAME",
+    "MONGO_FILES_COLLECTION_NAME",
+    "ADMIN_USERNAME",
+    "ADMIN_PASSWORD",
+)
+
+@dataclass(frozen=True)
+class Settings:
+    """Application configuration, read from the environment once at startup."""
+    telegram_bot_token: str
+    download_dir: Path
+    mongo_uri: str
+    mongo_db_name: str
+    mongo_collection_name: str
+    mongo_log_collection_name: str
+    mongo_files_collection_name: str
+    admin_username: str
+    admin_password: str
+    api_key: Optional[str] = None
+    premium_user_id: Optional[str] = None
+    file_host_base_url: Optional[str] = None
+    images_dir: Optional[Path] = None
+    admin_user_id: Optional[str] = None
+
+    @classmethod
+    def from_env(cls):
+        """Builds the settings from environment variables, failing fast if any are missing."""
+        missing = [name for name in REQUIRED_VARIABLES if not os.getenv(name)]
+        if missing:
+            raise RuntimeError(f"Missing required environment variables: {', '.join(missing)}")
+
+        images_dir = os.getenv("IMAGES_DIR")
+        return cls(
+            telegram_bot_token=os.environ["TELEGRAM_BOT_TOKEN"],
+            download_dir=Path(os.environ["DOWNLOAD_DIR"]),
+            mongo_uri=os.environ["MONGO_URI"],
+            mongo_db_name=os.environ["MONGO_DB_NAME"],
+            mongo_collection_name=os.environ["MONGO_COLLECTION_NAME"],
+            mongo_log_collection_name=os.environ["MONGO_LOG_COLLECTION_NAME"],
+            mongo_files_collection_name=os.environ["MONGO_FILES_COLLECTION_NAME"],
+            admin_username=os.environ["ADMIN_USERNAME"],
+            admin_password=os.environ["ADMIN_PASSWORD"],
+            api_key=os.getenv("API_KEY"),
+            premium_user_id=os.getenv("USER_ID"),
+            file_host_base_url=os.getenv("FILE_HOST_BASE_URL"),
+            images_dir=Path(images_dir) if images_dir else None,
+            admin_user_id=os.getenv("ADMIN_USER_ID"),
+        )
+
+settings = Settings.from_env()